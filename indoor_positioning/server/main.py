@@ -3,16 +3,22 @@ Indoor Positioning System - Enhanced with Detailed Logging
 """
 
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_socketio import SocketIO, emit
 import time
-import threading
 from datetime import datetime
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
 import logging
 import json
 import os
 import sys
+import hashlib
+import heapq
+import queue
+import threading
+import functools
 import numpy as np
+import orjson
 from trilateration import EnhancedTrilaterationEngine
 
 
@@ -31,24 +37,29 @@ class AdaptiveKalmanFilter:
         # Адаптивная настройка шума измерения на основе packet_count
         adaptive_R = self.R / min(packet_count, 5)  # Уменьшаем шум с ростом packet_count
 
-        # Прогноз
-        self.P = self.P + self.Q
+        # Прогноз (состояние в локальных переменных, атрибуты записываются один раз)
+        P = self.P + self.Q
 
         # Коррекция
-        K = self.P / (self.P + adaptive_R)
-        self.X = self.X + K * (measurement - self.X)
-        self.P = (1 - K) * self.P
+        K = P / (P + adaptive_R)
+        X = self.X + K * (measurement - self.X)
+        self.X = X
+        self.P = (1 - K) * P
 
         # Сохраняем историю для адаптации
-        self.measurement_history.append(measurement)
+        history = self.measurement_history
+        history.append(measurement)
         self.measurement_count += 1
 
         # Адаптируем шум процесса на основе дисперсии измерений
-        if len(self.measurement_history) >= 5:
-            variance = np.var(list(self.measurement_history))
+        count = len(history)
+        if count >= 5:
+            # Окно не длиннее 10 значений: на чистом Python быстрее, чем через np.var
+            mean = sum(history) / count
+            variance = sum([(x - mean) * (x - mean) for x in history]) / count
             self.Q = max(0.01, min(0.5, variance * 0.1))
 
-        return self.X
+        return X
 
     def get_confidence(self):
         """Возвращает уверенность в текущей оценке"""
@@ -56,14 +67,45 @@ class AdaptiveKalmanFilter:
             return 0.0
         return min(1.0, self.measurement_count / 10.0) * (1.0 / (1.0 + self.P))
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask на базе orjson"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class ORJSONSocketIO:
+    """Обертка orjson с интерфейсом модуля json для Socket.IO"""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'indoor_positioning_secret'
+app.json = ORJSONProvider(app)
+
+# Покадровое логирование Socket.IO/Engine.IO только для отладки: SOCKETIO_DEBUG=1
+SOCKETIO_DEBUG = os.environ.get('SOCKETIO_DEBUG', '').lower() in ('1', 'true', 'yes')
 
 socketio = SocketIO(app,
                     cors_allowed_origins="*",
+                    json=ORJSONSocketIO,
                     async_mode='threading',
-                    logger=True,
-                    engineio_logger=True)
+                    logger=SOCKETIO_DEBUG,
+                    engineio_logger=SOCKETIO_DEBUG)
 
 # Настройка расширенного логирования
 logging.basicConfig(
@@ -109,6 +151,64 @@ device_kalman_filters = defaultdict(AdaptiveKalmanFilter)
 device_channel_data = defaultdict(lambda: deque(maxlen=20))
 device_packet_stats = defaultdict(lambda: {'count': 0, 'first_seen': None})
 
+# Время жизни позиций и измерений (секунды)
+POSITION_TTL = 10
+MEASUREMENT_TTL = 10
+
+# Сколько последних измерений хранить на устройство
+MEASUREMENT_HISTORY = 10
+
+# Очереди истечения: min-heap из (время истечения, mac) и актуальные сроки по MAC
+position_expiry_heap = []
+position_deadlines = {}
+measurement_expiry_heap = []
+measurement_deadlines = {}
+
+# Ограничение числа отслеживаемых MAC: при переполнении вытесняется давно не слышанный
+MAX_TRACKED_DEVICES = 10000
+device_last_seen = OrderedDict()
+
+# Сглаживание позиций: вес нового решения в EMA и минимальный сдвиг для отправки клиентам (м)
+POSITION_SMOOTHING = 0.3
+POSITION_EMIT_THRESHOLD = 0.05
+position_filters = {}  # mac -> {'ema': np.ndarray, 'last_emitted': np.ndarray}
+
+# Минимальный интервал между пересчетами позиции одного устройства (секунды)
+POSITION_MIN_INTERVAL = 0.2
+last_position_calculation = {}  # mac -> time.time() последнего пересчета
+# Устройства, пропущенные из-за интервала: обработчик пакетов пересчитывает их, как только
+# интервал истечет, даже если новых пакетов для них нет
+pending_position_macs = set()
+
+# Пропуск трилатерации: если расстояния до всех якорей сдвинулись меньше порога (м),
+# предыдущая позиция переиспользуется
+DISTANCE_CHANGE_THRESHOLD = 0.05
+last_trilaterated_distances = {}  # mac -> {anchor_id: расстояние при последнем расчете}
+
+# Период фоновой задачи обслуживания и рассылки состояния (секунды)
+BACKGROUND_TASK_PERIOD = 2.0
+
+# Очередь пакетов от якорей: HTTP-обработчик только ставит пакет в очередь,
+# расчет и рассылку выполняет фоновый обработчик
+MEASUREMENT_QUEUE_SIZE = 1000
+measurement_queue = queue.Queue(maxsize=MEASUREMENT_QUEUE_SIZE)
+
+# Блокировка состояния: обработчик пакетов, фоновая задача (истечение, вытеснение) и
+# обработчики конфигурации работают в разных потоках и меняют хранилища и публикуют снимки
+# только под ней. Прием пакетов от якорей ее не берет, а запись файлов идет вне ее
+state_lock = threading.Lock()
+
+# Версии состояния для ETag: меняются при каждой мутации соответствующего хранилища
+STATE_EPOCH = int(time.time())
+state_version = {'anchors': 0, 'devices': 0, 'positions': 0}
+
+# Опубликованные снимки (версия, данные) для читателей: их пересобирает фоновая задача каждый
+# такт и обработчики конфигурации после изменений; обработчик пакетов не публикует - полная
+# копия всех устройств на каждый пакет стоила бы O(всех устройств). Читатели используют снимки
+# без обхода живых словарей.
+# Опубликованный словарь никогда не изменяется - только заменяется целиком.
+published_state = {key: (0, {}) for key in state_version}
+
 
 # Функции для обработки частот и коррекции расстояний
 def get_frequency_correction(channel):
@@ -209,7 +309,7 @@ def load_config():
             logger.info(f"✅ Room config loaded from {CONFIG_FILE}")
         else:
             room_config = DEFAULT_ROOM_CONFIG.copy()
-            save_room_config()
+            save_room_config(room_config)
             logger.info("✅ Default room config created")
     except Exception as e:
         logger.error(f"❌ Error loading room config: {e}")
@@ -222,26 +322,26 @@ def load_config():
             logger.info(f"✅ Anchors config loaded from {ANCHORS_FILE}")
         else:
             anchors_config = DEFAULT_ANCHORS_CONFIG.copy()
-            save_anchors_config()
+            save_anchors_config(anchors_config)
             logger.info("✅ Default anchors config created")
     except Exception as e:
         logger.error(f"❌ Error loading anchors config: {e}")
         anchors_config = DEFAULT_ANCHORS_CONFIG.copy()
 
-def save_room_config():
+def save_room_config(config):
     try:
         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(room_config, f, indent=2, ensure_ascii=False)
+            json.dump(config, f, indent=2, ensure_ascii=False)
         logger.info(f"💾 Room config saved to {CONFIG_FILE}")
         return True
     except Exception as e:
         logger.error(f"❌ Error saving room config: {e}")
         return False
 
-def save_anchors_config():
+def save_anchors_config(config):
     try:
         with open(ANCHORS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(anchors_config, f, indent=2, ensure_ascii=False)
+            json.dump(config, f, indent=2, ensure_ascii=False)
         logger.info(f"💾 Anchors config saved to {ANCHORS_FILE}")
         return True
     except Exception as e:
@@ -257,16 +357,16 @@ def load_acl_config():
             logger.info(f"✅ ACL config loaded from {ACL_CONFIG_FILE}")
         else:
             acl_config = DEFAULT_ACL_CONFIG.copy()
-            save_acl_config()
+            save_acl_config(acl_config)
             logger.info("✅ Default ACL config created")
     except Exception as e:
         logger.error(f"❌ Error loading ACL config: {e}")
         acl_config = DEFAULT_ACL_CONFIG.copy()
 
-def save_acl_config():
+def save_acl_config(config):
     try:
         with open(ACL_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(acl_config, f, indent=2, ensure_ascii=False)
+            json.dump(config, f, indent=2, ensure_ascii=False)
         logger.info(f"💾 ACL config saved to {ACL_CONFIG_FILE}")
         return True
     except Exception as e:
@@ -282,7 +382,7 @@ load_acl_config()
 anchors = {}  # Активные якоря с временными метками
 devices = {}  # Обнаруженные устройства
 positions = {}  # Рассчитанные позиции
-anchor_data = defaultdict(list)
+anchor_data = {}  # mac -> кольцевой буфер измерений, создается вместе с устройством
 
 # Статус системы
 system_status = {
@@ -365,40 +465,81 @@ def get_anchors_config():
     logger.info("📋 Anchors config requested")
     return jsonify(anchors_config)
 
+def _bump_state_version(*keys):
+    """Отмечает изменение хранилищ, чтобы сбросить ETag у клиентов"""
+    for key in keys:
+        state_version[key] += 1
+
+
+def _publish_state():
+    """Публикует свежие снимки изменившихся хранилищ (copy-on-write)"""
+    for key, version in state_version.items():
+        if published_state[key][0] != version:
+            published_state[key] = (version, _STATE_BUILDERS[key]())
+
+
+def _versioned_response(key):
+    """Отвечает 304, если у клиента актуальная версия, иначе сериализует снимок с ETag"""
+    version, payload = published_state[key]
+    etag = f"{key}-{STATE_EPOCH}-{version}"
+    if request.if_none_match.contains(etag):
+        return '', 304
+
+    response = jsonify(payload)
+    response.set_etag(etag)
+    return response
+
+
 @app.route('/api/anchors')
 def get_anchors():
-    return jsonify(dict(anchors))
+    return _versioned_response('anchors')
+
+
+def _serialize_devices():
+    # Создаем сериализуемую копию devices с применением ACL фильтрации
+    serializable_devices = {}
+    for mac, device in devices.items():
+        # ПРИМЕНЯЕМ ACL ФИЛЬТРАЦИЮ
+        if not _check_acl_filter(mac):
+            continue
+
+        serializable_devices[mac] = device.copy()
+        if 'channels_used' in serializable_devices[mac]:
+            serializable_devices[mac]['channels_used'] = list(serializable_devices[mac]['channels_used'])
+
+    return serializable_devices
 
 
 @app.route('/api/devices')
 def get_devices():
     try:
-        # Создаем сериализуемую копию devices с применением ACL фильтрации
-        serializable_devices = {}
-        for mac, device in devices.items():
-            # ПРИМЕНЯЕМ ACL ФИЛЬТРАЦИЮ
-            if not _check_acl_filter(mac):
-                continue
-
-            serializable_devices[mac] = device.copy()
-            if 'channels_used' in serializable_devices[mac]:
-                serializable_devices[mac]['channels_used'] = list(serializable_devices[mac]['channels_used'])
-
-        return jsonify(serializable_devices)
+        return _versioned_response('devices')
     except Exception as e:
         logger.error(f"❌ Error serializing devices: {e}")
         return jsonify({'error': 'Serialization error'}), 500
 
 
-@app.route('/api/positions')
-def get_positions():
+def _filter_positions():
     # ПРИМЕНЯЕМ ACL ФИЛЬТРАЦИЮ К ПОЗИЦИЯМ
     filtered_positions = {}
     for mac, position in positions.items():
         if _check_acl_filter(mac):
             filtered_positions[mac] = position
 
-    return jsonify(filtered_positions)
+    return filtered_positions
+
+
+@app.route('/api/positions')
+def get_positions():
+    return _versioned_response('positions')
+
+
+_STATE_BUILDERS = {
+    # Записи якорей меняются на месте - снимок копирует каждую, а не только внешний словарь
+    'anchors': lambda: {anchor_id: dict(anchor) for anchor_id, anchor in anchors.items()},
+    'devices': _serialize_devices,
+    'positions': _filter_positions
+}
 
 @app.route('/api/status')
 def get_status():
@@ -441,6 +582,7 @@ def _update_active_anchors_from_config():
             del anchors[anchor_id]
             logger.debug(f"🗑️ Removed disabled anchor {anchor_id} from active anchors")
 
+    _bump_state_version('anchors')
     logger.info(f"📊 Active anchors after config update: {list(anchors.keys())}")
 
 # API для обновления конфигураций
@@ -463,19 +605,25 @@ def update_room_config():
             logger.warning(f"❌ Room config validation failed: {validation_errors}")
             return jsonify({'error': 'Validation failed', 'details': validation_errors}), 400
 
-        # Сохраняем новую конфигурацию
-        room_config.update(data)
-        if save_room_config():
-            # ОБНОВЛЯЕМ АКТИВНЫЕ ЯКОРЯ С НОВЫМИ КООРДИНАТАМИ
-            _update_active_anchors_from_config()
+        # Сохраняем новую конфигурацию (файл пишется без блокировки состояния)
+        if save_room_config(new_room_config):
+            with state_lock:
+                room_config.update(data)
+
+                # ОБНОВЛЯЕМ АКТИВНЫЕ ЯКОРЯ С НОВЫМИ КООРДИНАТАМИ
+                _update_active_anchors_from_config()
+
+                # ОБНОВЛЯЕМ ДВИЖОК ТРИЛАТЕРАЦИИ С АКТУАЛЬНЫМИ ДАННЫМИ
+                enabled_anchors = {k: v for k, v in anchors_config.items() if v.get('enabled', True)}
+                trilateration_engine.update_room_config({
+                    'width': room_config['width'],
+                    'height': room_config['height'],
+                    'depth': room_config.get('depth', 5),
+                    'anchors': enabled_anchors
+                })
 
-            # ОБНОВЛЯЕМ ДВИЖОК ТРИЛАТЕРАЦИИ С АКТУАЛЬНЫМИ ДАННЫМИ
-            enabled_anchors = {k: v for k, v in anchors_config.items() if v.get('enabled', True)}
-            trilateration_engine.update_room_config({
-                'width': room_config['width'],
-                'height': room_config['height'],
-                'anchors': enabled_anchors
-            })
+                # Публикуем снимки, когда движок обновлен и конфигурация сохранена
+                _publish_state()
 
             logger.info(
                 f"✅ Room config updated: width={room_config['width']}, height={room_config['height']}, depth={room_config['depth']}")
@@ -483,7 +631,7 @@ def update_room_config():
 
             emit_log(f"Конфигурация комнаты обновлена: {room_config}", 'success')
             socketio.emit('room_config_updated', room_config)
-            socketio.emit('anchors_data', anchors)
+            socketio.emit('anchors_data', published_state['anchors'][1])
             logger.info("✅ Room config updated successfully")
             return jsonify({'status': 'success', 'config': room_config})
         else:
@@ -496,6 +644,7 @@ def update_room_config():
 
 @app.route('/api/config/anchors', methods=['POST'])
 def update_anchors_config():
+    global anchors_config
     try:
         data = request.get_json()
         logger.info(f"🔄 Anchors config update request: {data}")
@@ -509,20 +658,31 @@ def update_anchors_config():
             logger.warning(f"❌ Anchors config validation failed: {validation_errors}")
             return jsonify({'error': 'Validation failed', 'details': validation_errors}), 400
 
-        # Полностью заменяем конфигурацию
-        anchors_config.clear()
-        anchors_config.update(data)
+        # Сохраняем новую конфигурацию (файл пишется без блокировки состояния)
+        new_anchors_config = dict(data)
+        if not save_anchors_config(new_anchors_config):
+            logger.error("❌ Failed to save anchors config")
+            return jsonify({'error': 'Failed to save config'}), 500
 
-        # ОБНОВЛЯЕМ АКТИВНЫЕ ЯКОРЯ С НОВЫМИ КООРДИНАТАМИ
-        _update_active_anchors_from_config()
+        with state_lock:
+            # Полностью заменяем конфигурацию: словарь не изменяется на месте, поэтому
+            # receive_anchor_data читает его без блокировки
+            anchors_config = new_anchors_config
 
-        # ОБНОВЛЯЕМ ДВИЖОК ТРИЛАТЕРАЦИИ
-        enabled_anchors = {k: v for k, v in anchors_config.items() if v.get('enabled', True)}
-        trilateration_engine.update_room_config({
-            'width': room_config['width'],
-            'height': room_config['height'],
-            'anchors': enabled_anchors
-        })
+            # ОБНОВЛЯЕМ АКТИВНЫЕ ЯКОРЯ С НОВЫМИ КООРДИНАТАМИ
+            _update_active_anchors_from_config()
+
+            # ОБНОВЛЯЕМ ДВИЖОК ТРИЛАТЕРАЦИИ
+            enabled_anchors = {k: v for k, v in anchors_config.items() if v.get('enabled', True)}
+            trilateration_engine.update_room_config({
+                'width': room_config['width'],
+                'height': room_config['height'],
+                'depth': room_config.get('depth', 5),
+                'anchors': enabled_anchors
+            })
+
+            # Публикуем снимки, когда движок обновлен и конфигурация сохранена
+            _publish_state()
 
         # ЛОГИРУЕМ ИЗМЕНЕНИЯ
         logger.info(f"🔧 Anchors config updated: {len(enabled_anchors)} enabled anchors")
@@ -532,15 +692,11 @@ def update_anchors_config():
             if anchor_id in enabled_anchors:
                 logger.info(f"📍 Anchor {anchor_id}: ({new_config['x']}, {new_config['y']}, {new_config['z']})")
 
-        if save_anchors_config():
-            emit_log("Конфигурация якорей обновлена", 'success')
-            socketio.emit('anchors_config_updated', anchors_config)
-            socketio.emit('anchors_data', anchors)
-            logger.info("✅ Anchors config updated successfully")
-            return jsonify({'status': 'success', 'config': anchors_config})
-        else:
-            logger.error("❌ Failed to save anchors config")
-            return jsonify({'error': 'Failed to save config'}), 500
+        emit_log("Конфигурация якорей обновлена", 'success')
+        socketio.emit('anchors_config_updated', anchors_config)
+        socketio.emit('anchors_data', published_state['anchors'][1])
+        logger.info("✅ Anchors config updated successfully")
+        return jsonify({'status': 'success', 'config': anchors_config})
     except Exception as e:
         logger.error(f"❌ Error updating anchors config: {e}")
         return jsonify({'error': str(e)}), 500
@@ -573,62 +729,38 @@ def validate_config():
 def receive_anchor_data():
     try:
         data = request.get_json()
-        logger.info(f"📨 Data received from anchor: {data.get('anchor_id')}")
-
         if not data:
             logger.warning("❌ No data received")
             return jsonify({'error': 'Не получены данные'}), 400
 
         anchor_id = data.get('anchor_id')
         measurements = data.get('measurements', [])
+        logger.debug("📨 Data received from anchor: %s", anchor_id)
 
         if not anchor_id:
             logger.warning("❌ Missing anchor_id")
             return jsonify({'error': 'Отсутствует anchor_id'}), 400
 
-        # Проверяем, включен ли якорь в конфигурации
-        if anchor_id not in anchors_config:
+        # Проверяем, включен ли якорь в конфигурации. Словарь конфигурации заменяется
+        # целиком и не изменяется на месте, поэтому читается без блокировки
+        anchor_config = anchors_config.get(anchor_id)
+        if anchor_config is None:
             logger.warning(f"❌ Anchor {anchor_id} not found in config")
             return jsonify({'error': 'Anchor not found in config'}), 400
 
-        if not anchors_config[anchor_id].get('enabled', True):
+        if not anchor_config.get('enabled', True):
             logger.warning(f"❌ Anchor {anchor_id} is disabled")
             return jsonify({'error': 'Anchor disabled'}), 400
 
-        # ОБНОВЛЯЕМ ИНФОРМАЦИЮ О ЯКОРЕ С АКТУАЛЬНЫМИ КООРДИНАТАМИ ИЗ КОНФИГУРАЦИИ
-        anchor_config = anchors_config[anchor_id]
-        if anchor_id in anchors:
-            # Обновляем существующий якорь
-            anchors[anchor_id].update({
-                'x': anchor_config['x'],
-                'y': anchor_config['y'],
-                'z': anchor_config['z'],
-                'last_update': datetime.now().isoformat(),
-                'status': 'active',
-                'measurements_count': len(measurements)
-            })
-        else:
-            # Создаем новый активный якорь
-            anchors[anchor_id] = {
-                'x': anchor_config['x'],
-                'y': anchor_config['y'],
-                'z': anchor_config['z'],
-                'last_update': datetime.now().isoformat(),
-                'status': 'active',
-                'enabled': True,
-                'measurements_count': len(measurements)
-            }
-
-        logger.info(f"✅ Anchor {anchor_id} updated with coordinates ({anchor_config['x']}, {anchor_config['y']}, {anchor_config['z']})")
-
-        # Обрабатываем измерения
-        _process_anchor_measurements(anchor_id, measurements)
-
-        statistics['anchor_updates'] += 1
-        system_status['total_updates'] += 1
+        # Одна метка времени на весь пакет
+        now_iso = datetime.now().isoformat()
 
-        # Пересчитываем позиции
-        calculate_positions()
+        # Измерения обрабатываются в фоне, якорь не ждет трилатерации
+        try:
+            measurement_queue.put_nowait((anchor_id, measurements, now_iso))
+        except queue.Full:
+            logger.warning(f"⚠️ Measurement queue full, dropping packet from {anchor_id}")
+            return jsonify({'error': 'Server busy'}), 503
 
         return jsonify({'status': 'success', 'message': 'Данные получены'})
 
@@ -653,9 +785,17 @@ def update_acl_config():
         if not data:
             return jsonify({'error': 'No data provided'}), 400
 
-        acl_config.update(data)
+        # Сохраняем новую конфигурацию (файл пишется без блокировки состояния)
+        new_acl_config = acl_config.copy()
+        new_acl_config.update(data)
+        if save_acl_config(new_acl_config):
+            with state_lock:
+                acl_config.update(data)
+
+                # ACL влияет на состав выдачи устройств и позиций
+                _bump_state_version('devices', 'positions')
+                _publish_state()
 
-        if save_acl_config():
             emit_log("ACL конфигурация обновлена", 'success')
             socketio.emit('acl_config_updated', acl_config)
             logger.info("✅ ACL config updated successfully")
@@ -708,8 +848,48 @@ def _calculate_channel_consistency(mac):
     return max(0.1, min(1.0, consistency))
 
 
-def _process_anchor_measurements(anchor_id, measurements):
-    logger.info(f"📊 Processing {len(measurements)} measurements from {anchor_id}")
+def _update_anchor_entry(anchor_id, measurements_count, now_iso):
+    """Отмечает якорь активным с координатами из конфигурации; False, если якорь отключен"""
+    anchor_config = anchors_config.get(anchor_id)
+    if anchor_config is None or not anchor_config.get('enabled', True):
+        # Конфигурация изменилась, пока пакет ждал в очереди
+        logger.warning(f"⚠️ Anchor {anchor_id} is no longer enabled, dropping packet")
+        return False
+
+    # ОБНОВЛЯЕМ ИНФОРМАЦИЮ О ЯКОРЕ С АКТУАЛЬНЫМИ КООРДИНАТАМИ ИЗ КОНФИГУРАЦИИ
+    if anchor_id in anchors:
+        # Обновляем существующий якорь
+        anchors[anchor_id].update({
+            'x': anchor_config['x'],
+            'y': anchor_config['y'],
+            'z': anchor_config['z'],
+            'last_update': now_iso,
+            'status': 'active',
+            'measurements_count': measurements_count
+        })
+    else:
+        # Создаем новый активный якорь
+        anchors[anchor_id] = {
+            'x': anchor_config['x'],
+            'y': anchor_config['y'],
+            'z': anchor_config['z'],
+            'last_update': now_iso,
+            'status': 'active',
+            'enabled': True,
+            'measurements_count': measurements_count
+        }
+
+    _bump_state_version('anchors')
+    logger.debug("✅ Anchor %s updated with coordinates (%s, %s, %s)",
+                 anchor_id, anchor_config['x'], anchor_config['y'], anchor_config['z'])
+    return True
+
+
+def _process_anchor_measurements(anchor_id, measurements, now_iso):
+    """Обрабатывает измерения якоря; возвращает множество затронутых MAC"""
+    logger.debug("📊 Processing %d measurements from %s", len(measurements), anchor_id)
+    touched_macs = set()
+    now_ts = time.time()
 
     for measurement in measurements:
         # Проверяем ACL фильтрацию
@@ -746,7 +926,7 @@ def _process_anchor_measurements(anchor_id, measurements):
             # Сохраняем данные канала для анализа согласованности
             device_channel_data[mac].append({
                 'channel': measurement.get('channel', 1),
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now_iso,
                 'anchor_id': anchor_id
             })
 
@@ -764,17 +944,19 @@ def _process_anchor_measurements(anchor_id, measurements):
             if mac not in device_packet_stats:
                 device_packet_stats[mac] = {
                     'count': 0,
-                    'first_seen': datetime.now().isoformat()
+                    'first_seen': now_iso
                 }
             device_packet_stats[mac]['count'] += 1
 
             # СОЗДАЕМ ИЛИ ОБНОВЛЯЕМ УСТРОЙСТВО С SSID
-            if mac not in devices:
-                devices[mac] = {
+            device = devices.get(mac)
+            if device is None:
+                anchor_data[mac] = deque(maxlen=MEASUREMENT_HISTORY)
+                device = devices[mac] = {
                     'mac': mac,
                     'ssid': ssid,  # СОХРАНЯЕМ SSID
                     'hidden_ssid': hidden_ssid,
-                    'first_seen': datetime.now().isoformat(),
+                    'first_seen': now_iso,
                     'type': 'mobile_device',
                     'color': _generate_color_from_mac(mac),
                     'packet_count_total': 0,
@@ -784,16 +966,16 @@ def _process_anchor_measurements(anchor_id, measurements):
                 logger.info(f"📱 New device detected: {mac} (SSID: {ssid})")
             else:
                 # ОБНОВЛЯЕМ SSID ЕСЛИ ПОЛУЧИЛИ НОВЫЙ
-                if devices[mac].get('ssid') != ssid:
-                    devices[mac]['ssid'] = ssid
-                    devices[mac]['hidden_ssid'] = hidden_ssid
+                if device.get('ssid') != ssid:
+                    device['ssid'] = ssid
+                    device['hidden_ssid'] = hidden_ssid
                     logger.info(f"🔄 Device {mac} SSID updated: {ssid}")
 
             # Обновляем статистику устройства
-            devices[mac]['packet_count_total'] += 1
+            device['packet_count_total'] += 1
             channel = measurement.get('channel', 1)
-            if channel not in devices[mac]['channels_used']:
-                devices[mac]['channels_used'].append(channel)
+            if channel not in device['channels_used']:
+                device['channels_used'].append(channel)
 
             # Сохраняем обогащенные данные
             enriched_measurement = {
@@ -807,73 +989,74 @@ def _process_anchor_measurements(anchor_id, measurements):
                 'packet_count': measurement.get('packet_count', 1),
                 'distance_confidence': distance_confidence,
                 'channel_consistency': channel_consistency,
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now_ts,  # epoch-секунды: сравниваются без разбора строк
                 'device_timestamp': measurement.get('device_timestamp')
             }
 
-            # Ограничиваем количество измерений
-            if len(anchor_data[mac]) >= 10:
-                anchor_data[mac].pop(0)
+            # Кольцевой буфер сам вытесняет самое старое измерение
             anchor_data[mac].append(enriched_measurement)
+            _schedule_expiry(measurement_expiry_heap, measurement_deadlines, mac, now_ts + MEASUREMENT_TTL)
+            _touch_device(mac, now_ts)
+            _bump_state_version('devices')
+            touched_macs.add(mac)
+
+            logger.debug("📏 Device %s (%s): distance %.2fm", mac, ssid, corrected_distance)
 
-            logger.debug(f"📏 Device {mac} ({ssid}): distance {corrected_distance:.2f}m")
+    return touched_macs
 
 
-def calculate_positions():
+def calculate_positions(macs=None):
+    """Пересчитывает позиции устройств; macs ограничивает пересчет затронутыми устройствами"""
     try:
-        logger.info(f"🎯 Starting position calculation for {len(anchor_data)} devices")
-        logger.info(
-            f"📊 Using anchors config: {len([k for k, v in anchors_config.items() if v.get('enabled', True)])} enabled anchors")
+        target_macs = list(anchor_data) if macs is None else macs
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🎯 Starting position calculation for %d devices", len(target_macs))
+            logger.debug("📊 Using anchors config: %d enabled anchors",
+                         sum(1 for v in anchors_config.values() if v.get('enabled', True)))
 
         calculated_positions = 0
-        for mac, measurements_deque in anchor_data.items():
-            # ПРЕОБРАЗУЕМ deque В LIST
-            if isinstance(measurements_deque, deque):
-                measurements_list = list(measurements_deque)
-            else:
-                measurements_list = measurements_deque
-
-            if not isinstance(measurements_list, list):
-                logger.warning(f"⚠️ Invalid measurements_list for {mac}: {type(measurements_list)}")
+        updates = []  # Изменения позиций, отправляемые клиентам одним событием
+        now = time.time()
+        now_iso = datetime.now().isoformat()
+        for mac in target_macs:
+            pending_position_macs.discard(mac)
+            measurements_list = anchor_data.get(mac)
+            if not measurements_list:
                 continue
 
-            if len(measurements_list) == 0:
+            # Не пересчитываем одно устройство чаще POSITION_MIN_INTERVAL: свежие измерения
+            # не теряются - устройство откладывается до конца интервала
+            if now - last_position_calculation.get(mac, 0.0) < POSITION_MIN_INTERVAL:
+                pending_position_macs.add(mac)
                 continue
+            last_position_calculation[mac] = now
 
             # Проверяем структуру первого измерения
             if not isinstance(measurements_list[0], dict):
                 logger.warning(f"⚠️ Invalid measurement structure for {mac}: {type(measurements_list[0])}")
                 continue
 
-            if _calculate_device_position(mac, measurements_list):
+            if _calculate_device_position(mac, measurements_list, updates, now, now_iso):
                 calculated_positions += 1
 
+        if updates:
+            socketio.emit('positions_batch', updates)
+
         statistics['devices_detected'] = len(devices)
-        logger.info(f"✅ Position calculation completed: {calculated_positions} positions calculated")
+        logger.debug("✅ Position calculation completed: %d positions calculated", calculated_positions)
 
     except Exception as e:
         logger.error(f"❌ Error in position calculation: {e}")
         statistics['calculation_errors'] += 1
 
-def _group_recent_measurements(measurements_list):
-    anchor_measurements = {}
-    current_time = datetime.now()
-
-    for measurement in measurements_list:
-        measure_time = datetime.fromisoformat(measurement['timestamp'])
-        if (current_time - measure_time).total_seconds() <= 10:
-            anchor_id = measurement['anchor_id']
-            if anchor_id not in anchor_measurements:
-                anchor_measurements[anchor_id] = []
-            anchor_measurements[anchor_id].append(measurement['distance'])
-
-    return anchor_measurements
-
-
-def _group_enhanced_measurements(measurements_list):
+def _group_enhanced_measurements(measurements_list, now):
     """Группирует измерения по якорям с расширенными данными"""
     anchor_measurements = {}
-    current_time = datetime.now()
+    cutoff = now - MEASUREMENT_TTL
+
+    # Буфер упорядочен по времени: устаревшие измерения всегда в голове
+    while measurements_list and measurements_list[0]['timestamp'] < cutoff:
+        measurements_list.popleft()
 
     for measurement in measurements_list:
         # Проверяем структуру measurement
@@ -881,55 +1064,75 @@ def _group_enhanced_measurements(measurements_list):
             logger.warning(f"⚠️ Invalid measurement type: {type(measurement)}")
             continue
 
-        measure_time = datetime.fromisoformat(measurement['timestamp'])
-        if (current_time - measure_time).total_seconds() <= 10:
-            anchor_id = measurement['anchor_id']
-            if anchor_id not in anchor_measurements:
-                anchor_measurements[anchor_id] = []
-            anchor_measurements[anchor_id].append(measurement)
+        anchor_id = measurement['anchor_id']
+        if anchor_id not in anchor_measurements:
+            anchor_measurements[anchor_id] = []
+        anchor_measurements[anchor_id].append(measurement)
 
-    logger.debug(f"📊 Grouped measurements: {list(anchor_measurements.keys())}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📊 Grouped measurements: %s", list(anchor_measurements))
     return anchor_measurements
 
 
-def _calculate_device_position(mac, measurements_list):
+def _calculate_device_position(mac, measurements_list, updates, now, now_iso):
     try:
-        logger.debug(f"🎯 Calculating position for {mac} with {len(measurements_list)} measurements")
+        logger.debug("🎯 Calculating position for %s with %d measurements", mac, len(measurements_list))
 
         # Группируем измерения по якорям с расширенными данными
-        anchor_measurements = _group_enhanced_measurements(measurements_list)
+        anchor_measurements = _group_enhanced_measurements(measurements_list, now)
 
         if len(anchor_measurements) < 2:
-            logger.debug(f"⚠️ Not enough anchors for {mac}: {len(anchor_measurements)}")
+            logger.debug("⚠️ Not enough anchors for %s: %d", mac, len(anchor_measurements))
+            return False
+
+        # Движок использует последнее измерение каждого якоря
+        latest_distances = {anchor_id: m[-1]['distance'] for anchor_id, m in anchor_measurements.items()}
+        previous = positions.get(mac)
+
+        if previous and _distances_unchanged(last_trilaterated_distances.get(mac), latest_distances):
+            # Расстояния практически не изменились - продлеваем прежнюю позицию без пересчета
+            positions[mac] = {**previous, 'timestamp': now_iso}
+            _schedule_expiry(position_expiry_heap, position_deadlines, mac, now + POSITION_TTL)
+            _bump_state_version('positions')
+            logger.debug("⏭️ Distances unchanged for %s, reusing previous position", mac)
             return False
 
-        # Передаем расчет позиции И уверенности движку трилатерации
-        position = trilateration_engine.calculate_position(anchor_measurements)
+        # Передаем расчет позиции И уверенности движку трилатерации,
+        # стартуя оптимизацию с предыдущей позиции устройства
+        position = trilateration_engine.calculate_position(
+            anchor_measurements, previous['position'] if previous else None)
 
         if position:
+            last_trilaterated_distances[mac] = latest_distances
+
             # Берем confidence из результата движка
             confidence = position.get('confidence', 0.5)
+            should_emit = _smooth_position(mac, position)
+            device = devices.get(mac)
 
             positions[mac] = {
                 'position': position,  # position уже содержит confidence
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now_iso,
                 'confidence': confidence,
                 'anchors_used': len(anchor_measurements),
-                'avg_distance_confidence': np.mean(
-                    [m[-1].get('distance_confidence', 0.5) for m in anchor_measurements.values() if m]),
-                'type': devices[mac].get('type', 'unknown') if mac in devices else 'unknown'
+                'avg_distance_confidence': sum(
+                    m[-1].get('distance_confidence', 0.5) for m in anchor_measurements.values()
+                ) / len(anchor_measurements),
+                'type': device.get('type', 'unknown') if device else 'unknown'
             }
+            _schedule_expiry(position_expiry_heap, position_deadlines, mac, now + POSITION_TTL)
+            _bump_state_version('positions')
 
             statistics['position_updates'] += 1
-            system_status['last_calculation'] = datetime.now().isoformat()
-            _emit_position_update(mac, positions[mac])
+            system_status['last_calculation'] = now_iso
+            if should_emit and _check_acl_filter(mac):
+                updates.append(_position_update_payload(mac, positions[mac]))
 
-            logger.info(
-                f"📍 Position calculated for {mac}: ({position['x']:.2f}, {position['y']:.2f}, {position['z']:.2f}) "
-                f"with confidence {confidence:.2f}")
+            logger.debug("📍 Position calculated for %s: (%.2f, %.2f, %.2f) with confidence %.2f",
+                         mac, position['x'], position['y'], position['z'], confidence)
             return True
         else:
-            logger.debug(f"❌ Trilateration failed for {mac}")
+            logger.debug("❌ Trilateration failed for %s", mac)
             return False
 
     except Exception as e:
@@ -938,24 +1141,46 @@ def _calculate_device_position(mac, measurements_list):
         return False
 
 
-def _emit_position_update(mac, position_data):
-    # ПРИМЕНЯЕМ ACL ФИЛЬТРАЦИЮ ПЕРЕД ОТПРАВКОЙ
-    if not _check_acl_filter(mac):
-        return
+def _distances_unchanged(previous, current):
+    """Проверяет, что набор якорей тот же и ни одно расстояние не сдвинулось больше порога"""
+    if previous is None or previous.keys() != current.keys():
+        return False
+    return all(abs(current[anchor_id] - distance) < DISTANCE_CHANGE_THRESHOLD
+               for anchor_id, distance in previous.items())
+
+
+def _smooth_position(mac, position):
+    """Сглаживает позицию EMA на месте; возвращает True, если сдвиг достаточен для отправки"""
+    raw = np.array([position['x'], position['y'], position['z']])
+    state = position_filters.get(mac)
+
+    if state is None:
+        position_filters[mac] = {'ema': raw, 'last_emitted': raw}
+        return True
+
+    ema = (1 - POSITION_SMOOTHING) * state['ema'] + POSITION_SMOOTHING * raw
+    state['ema'] = ema
+    position['x'], position['y'], position['z'] = float(ema[0]), float(ema[1]), float(ema[2])
 
-    socketio.emit('position_update', {
+    if np.linalg.norm(ema - state['last_emitted']) > POSITION_EMIT_THRESHOLD:
+        state['last_emitted'] = ema
+        return True
+    return False
+
+
+def _position_update_payload(mac, position_data):
+    """Формирует запись об изменении позиции для события positions_batch"""
+    return {
         'device_id': mac,
         'position': position_data['position'],
         'timestamp': position_data['timestamp'],
         'confidence': position_data['confidence'],
         'anchors_used': position_data['anchors_used']
-    })
+    }
 
+@functools.lru_cache(maxsize=4096)
 def _generate_color_from_mac(mac):
-    import hashlib
-    hash_obj = hashlib.md5(mac.encode())
-    hash_hex = hash_obj.hexdigest()[:6]
-    return f'#{hash_hex}'
+    return f'#{hashlib.md5(mac.encode()).hexdigest()[:6]}'
 
 # WebSocket обработчики
 @socketio.on('connect')
@@ -963,15 +1188,23 @@ def handle_connect():
     statistics['connections'] += 1
     logger.info(f"🔌 Client connected. Total connections: {statistics['connections']}")
 
-    emit('system_status', system_status)
-    emit('anchors_data', anchors)
-    emit('devices_data', devices)
-    emit('positions_data', positions)
-    emit('statistics_update', statistics)
-    emit('room_config_updated', room_config)
-    emit('anchors_config_updated', anchors_config)
+    # Одно событие с полным состоянием вместо отдельного кадра на каждое хранилище
+    emit('snapshot', _build_snapshot())
     emit_log('Новый клиент подключился', 'info')
 
+
+def _build_snapshot():
+    """Собирает снимок состояния из опубликованных данных хранилищ"""
+    return {
+        'anchors': published_state['anchors'][1],
+        'devices': published_state['devices'][1],
+        'positions': published_state['positions'][1],
+        'system_status': system_status,
+        'statistics': statistics,
+        'room_config': room_config,
+        'anchors_config': anchors_config
+    }
+
 @socketio.on('disconnect')
 def handle_disconnect():
     statistics['connections'] = max(0, statistics['connections'] - 1)
@@ -996,50 +1229,87 @@ def emit_log(message, log_type='info'):
     socketio.emit('log_message', log_data)
 
 
+def _pending_positions_delay():
+    """Сколько ждать до пересчета отложенных устройств; None - отложенных нет"""
+    if not pending_position_macs:
+        return None
+    due = min(last_position_calculation.get(mac, 0.0) for mac in pending_position_macs) + POSITION_MIN_INTERVAL
+    return max(0.0, due - time.time())
+
+
+def measurement_worker():
+    """Фоновый обработчик пакетов от якорей: расчет позиций и рассылка клиентам"""
+    logger.info("🔄 Measurement worker started")
+
+    while True:
+        # Ждем пакет не дольше, чем до пересчета отложенных устройств
+        with state_lock:
+            timeout = _pending_positions_delay()
+        try:
+            item = measurement_queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+
+        try:
+            with state_lock:
+                touched_macs = set()
+                if item is not None:
+                    anchor_id, measurements, now_iso = item
+                    if _update_anchor_entry(anchor_id, len(measurements), now_iso):
+                        touched_macs = _process_anchor_measurements(anchor_id, measurements, now_iso)
+
+                    statistics['anchor_updates'] += 1
+                    system_status['total_updates'] += 1
+
+                # Пересчитываем позиции устройств из этого пакета и отложенных ранее;
+                # снимки для REST опубликует фоновая задача, клиенты уже получили positions_batch
+                calculate_positions(touched_macs | pending_position_macs)
+
+        except Exception as e:
+            logger.error(f"❌ Error processing anchor data: {e}")
+            statistics['calculation_errors'] += 1
+        finally:
+            if item is not None:
+                measurement_queue.task_done()
+
+
 def background_task():
     """Фоновая задача для обслуживания данных системы"""
     logger.info("🔄 Background task started")
 
+    # Такты по расписанию: длительность обработки не сдвигает период
+    next_tick = time.monotonic() + BACKGROUND_TASK_PERIOD
+
     while True:
         try:
-            current_time = datetime.now()
+            with state_lock:
+                current_time = datetime.now()
+                now = time.time()
+
+                # Автоматическое определение неактивных якорей
+                _update_anchors_status(current_time)
 
-            # Автоматическое определение неактивных якорей
-            _update_anchors_status(current_time)
+                # Очистка устаревших позиций
+                _cleanup_old_positions(now)
 
-            # Очистка устаревших позиций
-            _cleanup_old_positions(current_time)
+                # Очистка старых измерений
+                _cleanup_old_measurements(now)
 
-            # Очистка старых измерений
-            _cleanup_old_measurements(current_time)
+                # Обновление статистики активных якорей
+                _update_active_anchors_count()
 
-            # Обновление статистики активных якорей
-            _update_active_anchors_count()
+                # Публикуем снимки после всех изменений этого такта
+                _publish_state()
 
             # Отправка обновлений с обработкой ошибок сериализации
             try:
                 socketio.emit('system_status', system_status)
                 socketio.emit('statistics_update', statistics)
-                socketio.emit('anchors_data', anchors)
-
-                # Сериализуем devices с применением ACL фильтрации
-                serializable_devices = {}
-                for mac, device in devices.items():
-                    if _check_acl_filter(mac):  # ПРИМЕНЯЕМ ФИЛЬТРАЦИЮ
-                        serializable_devices[mac] = device.copy()
-                        if 'channels_used' in serializable_devices[mac]:
-                            serializable_devices[mac]['channels_used'] = list(
-                                serializable_devices[mac]['channels_used'])
-
-                socketio.emit('devices_data', serializable_devices)
+                socketio.emit('anchors_data', published_state['anchors'][1])
 
-                # Сериализуем позиции с применением ACL фильтрации
-                filtered_positions = {}
-                for mac, position in positions.items():
-                    if _check_acl_filter(mac):  # ПРИМЕНЯЕМ ФИЛЬТРАЦИЮ
-                        filtered_positions[mac] = position
-
-                socketio.emit('positions_data', filtered_positions)
+                # Снимки уже отфильтрованы по ACL
+                socketio.emit('devices_data', published_state['devices'][1])
+                socketio.emit('positions_data', published_state['positions'][1])
 
             except Exception as e:
                 logger.error(f"❌ Error emitting data: {e}")
@@ -1047,7 +1317,13 @@ def background_task():
         except Exception as e:
             logger.error(f"❌ Background task error: {e}")
 
-        time.sleep(2)
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            socketio.sleep(delay)
+        else:
+            # Такт не уложился в период - пропускаем отставание, а не догоняем пачкой
+            next_tick = time.monotonic()
+        next_tick += BACKGROUND_TASK_PERIOD
 
 def _update_active_anchors_count():
     """Обновляет счетчик активных якорей в статистике"""
@@ -1062,9 +1338,13 @@ def _update_active_anchors_count():
             # Якорь считается активным если обновлялся в последние 30 секунд
             if time_since_update <= 30:
                 active_count += 1
-                anchors[anchor_id]['status'] = 'active'
+                status = 'active'
             else:
-                anchors[anchor_id]['status'] = 'inactive'
+                status = 'inactive'
+
+            if anchor_data.get('status') != status:
+                anchors[anchor_id]['status'] = status
+                _bump_state_version('anchors')
 
     statistics['active_anchors'] = active_count
 
@@ -1080,6 +1360,7 @@ def _update_anchors_status(current_time):
         if time_since_update > 30:
             if anchor_data['status'] == 'active':
                 anchors[anchor_id]['status'] = 'inactive'
+                _bump_state_version('anchors')
                 logger.warning(f"⚠️ Anchor {anchor_id} marked as inactive (no data for {time_since_update:.1f}s)")
                 emit_log(f'Якорь {anchor_id} отключился (нет данных)', 'warning')
                 socketio.emit('anchor_updated', {
@@ -1095,52 +1376,95 @@ def _update_anchors_status(current_time):
     for anchor_id in inactive_anchors:
         if anchor_id in anchors:
             del anchors[anchor_id]
+            _bump_state_version('anchors')
             logger.warning(f"🗑️ Anchor {anchor_id} removed from system")
             emit_log(f'Якорь {anchor_id} удален из системы', 'warning')
             socketio.emit('anchor_removed', {'anchor_id': anchor_id})
 
-def _cleanup_old_positions(current_time):
-    expired_positions = []
-    for mac, pos_data in positions.items():
-        pos_time = datetime.fromisoformat(pos_data['timestamp'])
-        if (current_time - pos_time).total_seconds() > 10:
-            expired_positions.append(mac)
-
-    for mac in expired_positions:
-        del positions[mac]
-        logger.debug(f"🧹 Expired position removed: {mac}")
-        socketio.emit('position_removed', {'device_id': mac})
-
-def _cleanup_old_measurements(current_time):
-    """Очищает старые измерения (теперь это делается автоматически при добавлении новых)"""
-    # Теперь измерения автоматически ограничиваются до 10 последних
-    # Удаляем устройства без измерений
-    expired_devices = []
-    for mac in list(anchor_data.keys()):
-        if len(anchor_data[mac]) == 0:
-            expired_devices.append(mac)
-
-    for mac in expired_devices:
-        if mac in devices:
-            del devices[mac]
-            if mac in anchor_data:
-                del anchor_data[mac]
-            if mac in device_kalman_filters:
-                del device_kalman_filters[mac]
-            if mac in device_channel_data:
-                del device_channel_data[mac]
-            if mac in device_packet_stats:
-                del device_packet_stats[mac]
-            logger.debug(f"🧹 Expired device removed: {mac}")
-            socketio.emit('device_removed', {'device_id': mac})
+def _schedule_expiry(heap, deadlines, mac, deadline):
+    """Назначает срок истечения записи, не дублируя элементы в куче"""
+    if mac not in deadlines:
+        heapq.heappush(heap, (deadline, mac))
+    deadlines[mac] = deadline
+
+
+def _pop_expired(heap, deadlines, now):
+    """Извлекает из кучи MAC с истекшим сроком, продлевая обновленные записи"""
+    expired = []
+    while heap and heap[0][0] <= now:
+        _, mac = heapq.heappop(heap)
+        deadline = deadlines.get(mac)
+        if deadline is None:
+            continue
+        if deadline > now:
+            # Запись обновлялась после постановки в очередь - переносим срок
+            heapq.heappush(heap, (deadline, mac))
+        else:
+            del deadlines[mac]
+            expired.append(mac)
+    return expired
+
+
+def _cleanup_old_positions(now):
+    for mac in _pop_expired(position_expiry_heap, position_deadlines, now):
+        position_filters.pop(mac, None)
+        last_trilaterated_distances.pop(mac, None)
+        if mac in positions:
+            del positions[mac]
+            _bump_state_version('positions')
+            logger.debug("🧹 Expired position removed: %s", mac)
+            socketio.emit('position_removed', {'device_id': mac})
+
+def _cleanup_old_measurements(now):
+    """Удаляет устройства, от которых давно не было измерений"""
+    # Измерения старше MEASUREMENT_TTL не участвуют в расчете позиции
+    for mac in _pop_expired(measurement_expiry_heap, measurement_deadlines, now):
+        _remove_device(mac)
+        logger.debug("🧹 Expired device removed: %s", mac)
+
+
+def _touch_device(mac, now_ts):
+    """Отмечает устройство как недавно слышанное и вытесняет самые старые при переполнении"""
+    # Метка времени пакета, без отдельного time.time() на каждое измерение
+    device_last_seen[mac] = now_ts
+    device_last_seen.move_to_end(mac)
+
+    while len(device_last_seen) > MAX_TRACKED_DEVICES:
+        oldest_mac = next(iter(device_last_seen))
+        _remove_device(oldest_mac)
+        logger.debug("🧹 Device evicted (tracking limit reached): %s", oldest_mac)
+
+
+def _remove_device(mac):
+    """Удаляет все данные об устройстве из хранилищ"""
+    device_last_seen.pop(mac, None)
+    measurement_deadlines.pop(mac, None)
+    anchor_data.pop(mac, None)
+    device_kalman_filters.pop(mac, None)
+    device_channel_data.pop(mac, None)
+    device_packet_stats.pop(mac, None)
+    position_filters.pop(mac, None)
+    last_position_calculation.pop(mac, None)
+    pending_position_macs.discard(mac)
+    last_trilaterated_distances.pop(mac, None)
+
+    if positions.pop(mac, None) is not None:
+        position_deadlines.pop(mac, None)
+        _bump_state_version('positions')
+
+    if devices.pop(mac, None) is not None:
+        _bump_state_version('devices')
+        socketio.emit('device_removed', {'device_id': mac})
 
 
 if __name__ == '__main__':
     logger.info("🚀 Starting Indoor Positioning System...")
     logger.info("📍 Web interface: http://localhost:5000")
 
-    bg_thread = threading.Thread(target=background_task, daemon=True)
-    bg_thread.start()
+    # Фоновые задачи через Socket.IO. Сервер работает в режиме threading: обработчик пакетов
+    # блокируется на queue.Queue и threading.Lock, поэтому eventlet/gevent потребуют monkey_patch()
+    socketio.start_background_task(background_task)
+    socketio.start_background_task(measurement_worker)
 
     try:
         socketio.run(app,
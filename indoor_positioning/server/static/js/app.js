@@ -49,6 +49,11 @@ class IndoorPositioningApp {
             this.updateSystemStatus('ОФФЛАЙН');
         });
 
+        // Полное состояние при подключении
+        this.socket.on('snapshot', (snapshot) => {
+            this.applySnapshot(snapshot);
+        });
+
         // Данные системы
         this.socket.on('anchors_data', (anchors) => {
             this.updateAnchorsData(anchors);
@@ -62,8 +67,8 @@ class IndoorPositioningApp {
             this.updatePositionsData(positions);
         });
 
-        this.socket.on('position_update', (data) => {
-            this.handlePositionUpdate(data);
+        this.socket.on('positions_batch', (updates) => {
+            updates.forEach(data => this.handlePositionUpdate(data));
         });
 
         this.socket.on('position_removed', (data) => {
@@ -239,6 +244,17 @@ class IndoorPositioningApp {
         }
     }
 
+    applySnapshot(snapshot) {
+        this.roomConfig = snapshot.room_config;
+        this.anchorsConfig = snapshot.anchors_config;
+        this.updateSystemInfo(snapshot.system_status);
+        this.updateStatistics(snapshot.statistics);
+        this.updateAnchorsData(snapshot.anchors);
+        this.updateDevicesData(snapshot.devices);
+        this.updatePositionsData(snapshot.positions);
+        this.renderMap();
+    }
+
     updatePositionsData(positions) {
         this.positions = new Map(Object.entries(positions));
         this.renderDevicesOnMap();
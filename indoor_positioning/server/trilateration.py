@@ -8,93 +8,131 @@ Indoor Positioning System - Positioning Evaluations Module
 Indoor Positioning System - Enhanced Positioning Evaluations Module
 """
 
+import math
 import numpy as np
 import logging
-from typing import Dict, Optional, Any
+from collections import namedtuple
+from typing import Dict, Optional, Any, Tuple
 from scipy.optimize import minimize
 
 logger = logging.getLogger(__name__)
 
+# Взвешенное измерение якоря: последнее измерение и его вес для расчета позиции
+WeightedMeasurement = namedtuple(
+    'WeightedMeasurement', 'distance weight confidence rssi_filtered channel')
+
+# Промежуточная позиция методов расчета: (x, y, z)
+Position = Tuple[float, float, float]
+
+# Базовая уверенность по числу якорей: индекс - количество якорей (4 и более - последний)
+BASE_CONFIDENCE_BY_ANCHORS = (0.2, 0.2, 0.5, 0.7, 0.8)
+
 
 class EnhancedTrilaterationEngine:
     """Улучшенный движок для расчета позиции с использованием расширенных данных."""
 
     def __init__(self, room_config: Dict[str, Any]) -> None:
+        self.update_room_config(room_config)
+
+    def update_room_config(self, room_config: Dict[str, Any]) -> None:
+        """Применяет новую конфигурацию комнаты и пересобирает кэш координат якорей и границ."""
         self.room_config = room_config
+        width, height = room_config['width'], room_config['height']
+
+        # Границы поиска решения и зона коррекции позиции (отступ 0.5 м от стен)
+        self._room_size = (width, height)
+        self._bounds_upper = np.array([width, height, room_config.get('depth', 5)], dtype=np.float64)
+        self._correction_x = (0.5, width - 0.5)
+        self._correction_y = (0.5, height - 0.5)
+
+        # Верхние границы пристеночной зоны (2 м от стен) для оценки высоты
+        self._wall_margin_upper = (width - 2, height - 2)
+        anchors = room_config['anchors']
+        self._anchor_ids = list(anchors)
+        self._anchor_index = {anchor_id: i for i, anchor_id in enumerate(self._anchor_ids)}
+        self._anchor_xyz = np.array([[a['x'], a['y'], a['z']] for a in anchors.values()],
+                                    dtype=np.float64).reshape(-1, 3)
+
+    def _gather(self, weighted_measurements: Dict[str, WeightedMeasurement]):
+        """Возвращает координаты (N, 3), расстояния и веса для якорей из конфигурации."""
+        n = len(weighted_measurements)
+        rows = np.empty(n, dtype=np.intp)
+        distances = np.empty(n, dtype=np.float64)
+        weights = np.empty(n, dtype=np.float64)
+
+        count = 0
+        for anchor_id, data in weighted_measurements.items():
+            row = self._anchor_index.get(anchor_id)
+            if row is not None:
+                rows[count] = row
+                distances[count] = data.distance
+                weights[count] = data.weight
+                count += 1
+
+        return self._anchor_xyz[rows[:count]], distances[:count], weights[:count]
 
-    def calculate_position(self, anchor_measurements: Dict[str, Any]) -> Optional[Dict[str, float]]:
-        """Основная функция расчета позиции с использованием расширенных данных."""
+    def calculate_position(self, anchor_measurements: Dict[str, Any],
+                           initial_guess: Optional[Dict[str, float]] = None) -> Optional[Dict[str, float]]:
+        """Основная функция расчета позиции с использованием расширенных данных.
+
+        initial_guess - предыдущая позиция устройства для теплого старта оптимизации.
+        """
         try:
             # Проверяем что anchor_measurements - это словарь с данными
             if not anchor_measurements or len(anchor_measurements) < 2:
-                print(f"⚠️  Not enough anchor measurements: {len(anchor_measurements)}")
+                logger.debug("⚠️ Not enough anchor measurements: %d", len(anchor_measurements))
                 return None
 
-            print(f"🎯 Начало расчета позиции для {len(anchor_measurements)} якорей")
-
-            # Детальная проверка структуры данных
-            for anchor_id, measurements in anchor_measurements.items():
-                print(f"   🔍 Anchor {anchor_id}: {len(measurements)} measurements")
-                if not isinstance(measurements, list) or not measurements:
-                    print(f"   ⚠️  Invalid measurements for anchor {anchor_id}: {type(measurements)}")
-                    return None
+            logger.debug("🎯 Начало расчета позиции для %d якорей", len(anchor_measurements))
 
-            # Взвешиваем измерения по уверенности
+            # Взвешиваем измерения по уверенности (некорректные записи якорей отбрасываются здесь)
             weighted_measurements = self._apply_measurement_weights(anchor_measurements)
 
             if not weighted_measurements:
-                print("⚠️  No valid weighted measurements")
+                logger.debug("⚠️ No valid weighted measurements")
                 return None
 
-            print(f"   ✅ Weighted measurements ready: {len(weighted_measurements)} anchors")
+            logger.debug("✅ Weighted measurements ready: %d anchors", len(weighted_measurements))
 
-            # Проверяем структуру weighted_measurements
-            for anchor_id, data in weighted_measurements.items():
-                if not isinstance(data, dict):
-                    print(f"   ⚠️  Invalid weighted data for {anchor_id}: {type(data)}")
-                    return None
-                print(f"   📋 Weighted data keys for {anchor_id}: {list(data.keys())}")
+            # Сопоставляем измерения с якорями конфигурации один раз для всех методов
+            anchors_xyz, distances, weights = self._gather(weighted_measurements)
 
             # Пробуем последовательно разные методы с улучшенными данными
-            position = self.enhanced_trilateration_3d(weighted_measurements)
-            if not position or not self.is_valid_position(position):
-                print("   🔄 Trying confidence weighted centroid")
-                position = self.confidence_weighted_centroid(weighted_measurements)
-            if not position or not self.is_valid_position(position):
-                print("   🔄 Trying adaptive geometric method")
-                position = self.adaptive_geometric_method(weighted_measurements)
-            if position and not self.is_valid_position(position):
-                print("   🔄 Correcting position")
+            position = self.enhanced_trilateration_3d(anchors_xyz, distances, weights, initial_guess)
+            if position is None or not self.is_valid_position(position):
+                logger.debug("🔄 Trying confidence weighted centroid")
+                position = self.confidence_weighted_centroid(anchors_xyz, distances, weights)
+            if position is None or not self.is_valid_position(position):
+                logger.debug("🔄 Trying adaptive geometric method")
+                position = self.adaptive_geometric_method(anchors_xyz, distances, weights)
+            if position is not None and not self.is_valid_position(position):
+                logger.debug("🔄 Correcting position")
                 position = self.correct_position(position)
 
-            if position:
-                # Рассчитываем уверенность
-                confidence = calculate_enhanced_confidence(weighted_measurements, position, self.room_config)
-                print(f"   🎯 Final confidence: {confidence:.2f}")
-                position['confidence'] = confidence
-                return position
-            else:
-                confidence = 0.1
+            if position is None:
+                return None
+
+            # Методы возвращают кортежи (x, y, z) - словарь собирается один раз на выходе
+            x, y, z = position
+            result = {'x': x, 'y': y, 'z': z}
 
-            return position
+            # Рассчитываем уверенность
+            confidence = calculate_enhanced_confidence(weighted_measurements, result, self.room_config)
+            logger.debug("🎯 Final confidence: %.2f", confidence)
+            result['confidence'] = confidence
+            return result
 
         except Exception as e:
-            print(f"❌ Ошибка расчета позиции: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Ошибка расчета позиции: %s", e)
             return None
 
-    def _apply_measurement_weights(self, anchor_measurements: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    def _apply_measurement_weights(self, anchor_measurements: Dict[str, Any]) -> Dict[str, WeightedMeasurement]:
         """Применяет веса к измерениям с улучшенной формулой."""
-        print(f"   🔍 Applying weights to {len(anchor_measurements)} anchor measurements")
-
         weighted_data = {}
 
         for anchor_id, measurements in anchor_measurements.items():
-            print(f"   📋 Processing anchor {anchor_id}: {len(measurements)} measurements")
-
             if not measurements or not isinstance(measurements, list):
-                print(f"   ⚠️  No measurements for anchor {anchor_id}")
+                logger.debug("⚠️ No measurements for anchor %s", anchor_id)
                 continue
 
             # Берем последнее измерение
@@ -102,221 +140,245 @@ class EnhancedTrilaterationEngine:
 
             # Проверяем структуру измерения
             if not isinstance(latest_measurement, dict):
-                print(f"   ⚠️  Invalid measurement type for anchor {anchor_id}: {type(latest_measurement)}")
+                logger.warning("⚠️ Invalid measurement type for anchor %s: %s", anchor_id, type(latest_measurement))
                 continue
 
-            print(f"   📝 Measurement keys: {list(latest_measurement.keys())}")
-
-            # Базовые параметры
-            distance_confidence = latest_measurement.get('distance_confidence', 0.5)
-            packet_count = latest_measurement.get('packet_count', 1)
-            channel_consistency = latest_measurement.get('channel_consistency', 0.5)
-            rssi_filtered = latest_measurement.get('rssi_filtered', -70)
+            # Базовые параметры (get привязан локально - один поиск атрибута на измерение)
+            get = latest_measurement.get
+            distance_confidence = get('distance_confidence', 0.5)
+            packet_count = get('packet_count', 1)
+            channel_consistency = get('channel_consistency', 0.5)
 
             # Упрощенная формула весов
             confidence_weight = distance_confidence * 0.6
             packet_weight = min(1.0, packet_count / 5.0) * 0.3
             channel_weight = channel_consistency * 0.1
 
-            total_weight = confidence_weight + packet_weight + channel_weight
-            total_weight = min(1.0, total_weight)
+            total_weight = min(1.0, confidence_weight + packet_weight + channel_weight)
 
-            weighted_data[anchor_id] = {
-                'distance': latest_measurement.get('distance', 0),
-                'weight': total_weight,
-                'confidence': distance_confidence,  # ЭТО поле важно для calculate_enhanced_confidence!
-                'rssi_filtered': rssi_filtered,
-                'channel': latest_measurement.get('channel', 1),
-                'original_data': measurements  # Сохраняем все измерения для отладки
-            }
-
-            print(f"   ✅ {anchor_id}: weight={total_weight:.2f}, conf={distance_confidence:.2f}")
+            weighted_data[anchor_id] = WeightedMeasurement(
+                distance=float(get('distance', 0.0)),
+                weight=total_weight,
+                confidence=distance_confidence,  # ЭТО поле важно для calculate_enhanced_confidence!
+                rssi_filtered=get('rssi_filtered', -70),
+                channel=get('channel', 1)
+            )
 
-        print(f"   📊 Created weighted data for {len(weighted_data)} anchors")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📊 Weights: %s", ", ".join(
+                f"{anchor_id}={data.weight:.2f}/{data.confidence:.2f}" for anchor_id, data in weighted_data.items()))
         return weighted_data
 
-    def enhanced_trilateration_3d(self, weighted_measurements: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, float]]:
+    def enhanced_trilateration_3d(self, anchors_xyz: np.ndarray, distances: np.ndarray, weights: np.ndarray,
+                                  initial_guess: Optional[Dict[str, float]] = None) -> Optional[Position]:
         """Улучшенная 3D трилатерация с весами измерений."""
         try:
-            if len(weighted_measurements) < 3:
+            if len(distances) < 3:
                 return None
 
-            print("📍 Используем улучшенную 3D трилатерацию")
-
-            # Подготавливаем данные с весами
-            anchors_list = []
-            distances_list = []
-            weights_list = []
-
-            for anchor_id, data in weighted_measurements.items():
-                if anchor_id in self.room_config['anchors']:
-                    anchor = self.room_config['anchors'][anchor_id]
-                    anchors_list.append([anchor['x'], anchor['y'], anchor['z']])
-                    distances_list.append(data['distance'])
-                    weights_list.append(data['weight'])
-
-            # Метод наименьших квадратов с весами
-            def error_function(pos):
-                x, y, z = pos
-                total_error = 0.0
-                for i, (anchor, dist, weight) in enumerate(zip(anchors_list, distances_list, weights_list)):
-                    calculated_dist = np.sqrt((x - anchor[0]) ** 2 + (y - anchor[1]) ** 2 + (z - anchor[2]) ** 2)
-                    error = (calculated_dist - dist) ** 2
-                    total_error += error * weight
-                return total_error
-
-            # Начальное приближение - центр комнаты
-            initial_guess = [self.room_config['width'] / 2,
-                             self.room_config['height'] / 2,
-                             self.room_config.get('depth', 5) / 2]
-
-            # Границы комнаты
-            bounds = [(0, self.room_config['width']),
-                      (0, self.room_config['height']),
-                      (0, self.room_config.get('depth', 5))]
-
-            result = minimize(error_function, initial_guess, bounds=bounds, method='L-BFGS-B')
-
-            if result.success:
-                position = {
-                    'x': float(result.x[0]),
-                    'y': float(result.x[1]),
-                    'z': float(result.x[2])
-                }
-
-                print(f"✅ Успешная улучшенная 3D трилатерация: {position}")
+            logger.debug("📍 Используем улучшенную 3D трилатерацию")
+
+            # Дальние измерения шумнее: обратная дисперсия через расстояние, w_i = 1 / (d_i + 0.5)²
+            weights = weights / (distances + 0.5) ** 2
+
+            # Начальное приближение - предыдущая позиция (устройства движутся медленно),
+            # иначе линейное решение в плоскости XY на середине высоты комнаты
+            upper = self._bounds_upper
+            if initial_guess is not None:
+                x0 = [initial_guess['x'], initial_guess['y'], initial_guess['z']]
+            else:
+                x0 = self._linear_initial_guess(anchors_xyz, distances, weights, upper)
+
+            # Быстрый путь - Гаусс-Ньютон; L-BFGS-B, если система вырождена или решение вне комнаты
+            solution = self._gauss_newton(anchors_xyz, distances, weights,
+                                          np.clip(np.asarray(x0, dtype=np.float64), 0.0, upper), upper)
+            if solution is None:
+                solution = self._minimize_weighted_error(anchors_xyz, distances, weights, x0, upper)
+
+            if solution is not None:
+                position = (float(solution[0]), float(solution[1]), float(solution[2]))
+                logger.debug("✅ Успешная улучшенная 3D трилатерация: %s", position)
                 return position
 
             return None
 
         except Exception as e:
-            print(f"Улучшенная 3D трилатерация не удалась: {e}")
+            logger.warning("⚠️ Улучшенная 3D трилатерация не удалась: %s", e)
             return None
 
-    def confidence_weighted_centroid(self, weighted_measurements: Dict[str, Dict[str, Any]]) -> Optional[
-        Dict[str, float]]:
+    @staticmethod
+    def _linear_initial_guess(anchors_xyz, distances, weights, upper):
+        """Начальное приближение из линеаризованной системы (вычитание уравнения первого якоря).
+
+        Якоря обычно висят почти на одной высоте, поэтому Z из линейного решения ненадежна -
+        берется только XY, а высота ставится в середину комнаты.
+        """
+        x0 = upper / 2
+        system = 2.0 * (anchors_xyz[1:] - anchors_xyz[0])
+        rhs = (distances[0] ** 2 - distances[1:] ** 2
+               + (anchors_xyz[1:] ** 2).sum(axis=1) - anchors_xyz[0] @ anchors_xyz[0])
+
+        if len(distances) == 3:
+            # Три якоря: при фиксированной высоте система квадратная 2x2 - решаем напрямую
+            (a11, a12, a13), (a21, a22, a23) = system
+            b1 = rhs[0] - a13 * x0[2]
+            b2 = rhs[1] - a23 * x0[2]
+            det = a11 * a22 - a12 * a21
+            if abs(det) > 1e-9:
+                x0[0] = min(max((a22 * b1 - a12 * b2) / det, 0.0), upper[0])
+                x0[1] = min(max((a11 * b2 - a21 * b1) / det, 0.0), upper[1])
+            return x0
+
+        # Больше трех якорей: взвешенные нормальные уравнения 2x2 (AᵀWA)·xy = AᵀW·b вместо SVD в lstsq
+        planar = system[:, :2]
+        weighted = planar.T * weights[1:]
+        (n11, n12), (n21, n22) = weighted @ planar
+        b1, b2 = weighted @ (rhs - system[:, 2] * x0[2])
+        det = n11 * n22 - n12 * n21
+        if abs(det) > 1e-9:
+            x0[0] = min(max((n22 * b1 - n12 * b2) / det, 0.0), upper[0])
+            x0[1] = min(max((n11 * b2 - n21 * b1) / det, 0.0), upper[1])
+        return x0
+
+    @staticmethod
+    def _gauss_newton(anchors_xyz, distances, weights, x0, upper, max_iter=20, tol=1e-6):
+        """Взвешенный Гаусс-Ньютон с демпфированием (Левенберг-Марквардт).
+
+        Шаг принимается только если уменьшает ошибку, иначе демпфирование усиливается.
+        Возвращает None, если нормальные уравнения вырождены или решение вышло за границы
+        комнаты - тогда нужна оптимизация с ограничениями.
+        """
+        def residuals(pos):
+            diff = pos - anchors_xyz
+            calculated_dist = np.maximum(np.sqrt(np.einsum('ij,ij->i', diff, diff)), 1e-9)
+            residual = calculated_dist - distances
+            return diff, calculated_dist, residual, float(weights @ (residual * residual))
+
+        x = x0
+        diff, calculated_dist, residual, error = residuals(x)
+        damping = 1e-3
+
+        for _ in range(max_iter):
+            jacobian = diff / calculated_dist[:, None]
+            jtw = jacobian.T * weights
+            normal = jtw @ jacobian
+
+            try:
+                step = np.linalg.solve(normal + damping * np.diag(np.diag(normal)), jtw @ residual)
+            except np.linalg.LinAlgError:
+                return None
+
+            candidate = residuals(x - step)
+            if candidate[3] < error:
+                x = x - step
+                diff, calculated_dist, residual, error = candidate
+                damping = max(damping * 0.3, 1e-7)
+                if step @ step < tol * tol:
+                    break
+            else:
+                damping *= 10.0
+                if damping > 1e6:
+                    break
+
+        # Скалярная проверка без временных массивов: сравнения с NaN ложны, inf выходит за границы
+        if all(0.0 <= value <= bound for value, bound in zip(x.tolist(), upper.tolist())):
+            return x
+        return None
+
+    @staticmethod
+    def _minimize_weighted_error(anchors_xyz, distances, weights, x0, upper):
+        """Запасной путь: взвешенный МНК через L-BFGS-B с аналитическим градиентом."""
+        def error_function(pos):
+            diff = pos - anchors_xyz
+            calculated_dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+            error = calculated_dist - distances
+            total_error = float(weights @ (error * error))
+            coef = 2.0 * weights * error / np.maximum(calculated_dist, 1e-12)
+            return total_error, coef @ diff
+
+        bounds = [(0, bound) for bound in upper]
+        result = minimize(error_function, x0, jac=True, bounds=bounds, method='L-BFGS-B')
+        return result.x if result.success else None
+
+    def confidence_weighted_centroid(self, anchors_xyz: np.ndarray, distances: np.ndarray,
+                                     weights: np.ndarray) -> Optional[Position]:
         """Метод взвешенного центра с учетом уверенности измерений."""
         try:
-            print("📍 Используем метод взвешенного центра с уверенностью")
-
-            total_weight = 0
-            x_sum, y_sum, z_sum = 0, 0, 0
-
-            for anchor_id, data in weighted_measurements.items():
-                if anchor_id in self.room_config['anchors']:
-                    anchor = self.room_config['anchors'][anchor_id]
-                    weight = data['weight']
-
-                    # Учитываем расстояние в весе (близкие якоря имеют больший вес)
-                    distance_weight = 1.0 / (data['distance'] + 0.1)
-
-                    # Комбинированный вес
-                    combined_weight = weight * distance_weight
+            logger.debug("📍 Используем метод взвешенного центра с уверенностью")
 
-                    x_sum += anchor['x'] * combined_weight
-                    y_sum += anchor['y'] * combined_weight
-                    z_sum += anchor['z'] * combined_weight
-                    total_weight += combined_weight
+            # Учитываем расстояние в весе (близкие якоря имеют больший вес)
+            combined_weights = weights / (distances + 0.1)
+            total_weight = combined_weights.sum()
 
             if total_weight > 0:
-                x = x_sum / total_weight
-                y = y_sum / total_weight
-                z = z_sum / total_weight
+                x, y = (anchors_xyz[:, :2] * combined_weights[:, None]).sum(axis=0) / total_weight
+                x, y = float(x), float(y)
 
                 # Интеллектуальная коррекция высоты
-                z = self._estimate_enhanced_z_coordinate(x, y, weighted_measurements)
+                z = self._estimate_enhanced_z_coordinate(x, y, anchors_xyz, distances, weights)
 
-                result = {'x': x, 'y': y, 'z': z}
-                print(f"✅ Метод взвешенного центра: {result}")
+                result = (x, y, z)
+                logger.debug("✅ Метод взвешенного центра: %s", result)
                 return result
 
             return None
 
         except Exception as e:
-            print(f"Метод взвешенного центра не удался: {e}")
+            logger.warning("⚠️ Метод взвешенного центра не удался: %s", e)
             return None
 
-    def adaptive_geometric_method(self, weighted_measurements: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, float]]:
+    def adaptive_geometric_method(self, anchors_xyz: np.ndarray, distances: np.ndarray,
+                                  weights: np.ndarray) -> Optional[Position]:
         """Адаптивный геометрический метод с учетом качества измерений."""
         try:
-            print("🔄 Используем адаптивный геометрический метод")
+            logger.debug("🔄 Используем адаптивный геометрический метод")
 
-            if len(weighted_measurements) < 2:
+            if len(distances) < 2:
                 return None
 
-            # Сортируем измерения по уверенности
-            sorted_measurements = sorted(
-                weighted_measurements.items(),
-                key=lambda x: x[1]['weight'],
-                reverse=True
+            # Используем два наиболее надежных измерения для начальной оценки
+            # (устойчивая сортировка: при равных весах сохраняется порядок якорей)
+            first, second = np.argsort(-weights, kind='stable')[:2]
+
+            # Находим точки пересечения двух наиболее надежных окружностей
+            intersections = self._find_circle_intersections(
+                anchors_xyz[first, :2], distances[first],
+                anchors_xyz[second, :2], distances[second]
             )
 
-            # Используем два наиболее надежных измерения для начальной оценки
-            best_measurements = sorted_measurements[:2]
-
-            circles = []
-            for anchor_id, data in best_measurements:
-                if anchor_id in self.room_config['anchors']:
-                    anchor = self.room_config['anchors'][anchor_id]
-                    circles.append({
-                        'center': (anchor['x'], anchor['y']),
-                        'radius': data['distance'],
-                        'weight': data['weight']
-                    })
-
-            if len(circles) >= 2:
-                # Находим точки пересечения двух наиболее надежных окружностей
-                intersections = self._find_circle_intersections(
-                    circles[0]['center'], circles[0]['radius'],
-                    circles[1]['center'], circles[1]['radius']
-                )
-
-                if intersections:
-                    # Выбираем точку, ближайшую к другим якорям
-                    best_point = self._select_best_intersection(intersections, weighted_measurements)
-                    z = self._estimate_enhanced_z_coordinate(best_point[0], best_point[1], weighted_measurements)
-
-                    result = {'x': best_point[0], 'y': best_point[1], 'z': z}
-                    print(f"✅ Адаптивный геометрический метод: {result}")
-                    return result
+            if intersections:
+                # Выбираем точку, ближайшую к другим якорям
+                best_point = self._select_best_intersection(intersections, anchors_xyz, distances, weights)
+                z = self._estimate_enhanced_z_coordinate(best_point[0], best_point[1],
+                                                         anchors_xyz, distances, weights)
+
+                result = (best_point[0], best_point[1], z)
+                logger.debug("✅ Адаптивный геометрический метод: %s", result)
+                return result
 
             return None
 
         except Exception as e:
-            print(f"Адаптивный геометрический метод не удался: {e}")
+            logger.warning("⚠️ Адаптивный геометрический метод не удался: %s", e)
             return None
 
-    def _estimate_enhanced_z_coordinate(self, x: float, y: float,
-                                        weighted_measurements: Dict[str, Dict[str, Any]]) -> float:
+    def _estimate_enhanced_z_coordinate(self, x: float, y: float, anchors_xyz: np.ndarray,
+                                        distances: np.ndarray, weights: np.ndarray) -> float:
         """Улучшенная оценка Z-координаты с учетом качества измерений."""
         try:
-            total_weight = 0
-            z_weighted = 0
-
-            for anchor_id, data in weighted_measurements.items():
-                if anchor_id in self.room_config['anchors']:
-                    anchor = self.room_config['anchors'][anchor_id]
-                    weight = data['weight']
+            # Учитываем горизонтальное расстояние до якоря
+            horizontal_dist = np.hypot(x - anchors_xyz[:, 0], y - anchors_xyz[:, 1])
 
-                    # Учитываем горизонтальное расстояние до якоря
-                    horizontal_dist = np.sqrt((x - anchor['x']) ** 2 + (y - anchor['y']) ** 2)
-                    distance_ratio = data['distance'] / (horizontal_dist + 0.1)
+            # Оцениваем вертикальную компоненту (нулевую, если расстояние не больше горизонтального)
+            z_diff = np.sqrt(np.maximum(distances ** 2 - horizontal_dist ** 2, 0.0))
+            estimated_z = anchors_xyz[:, 2] + z_diff
 
-                    # Оцениваем вертикальную компоненту
-                    if data['distance'] > horizontal_dist:
-                        z_diff = np.sqrt(data['distance'] ** 2 - horizontal_dist ** 2)
-                        estimated_z = anchor['z'] + z_diff
-                    else:
-                        estimated_z = anchor['z']
-
-                    z_weighted += estimated_z * weight
-                    total_weight += weight
-
-            avg_z = z_weighted / total_weight if total_weight > 0 else 1.5
+            total_weight = weights.sum()
+            avg_z = float(estimated_z @ weights / total_weight) if total_weight > 0 else 1.5
 
             # Корректируем based на позиции и качестве измерений
-            close_to_wall = (x < 2.0 or x > self.room_config['width'] - 2 or
-                             y < 2.0 or y > self.room_config['height'] - 2)
+            x_max, y_max = self._wall_margin_upper
+            close_to_wall = x < 2.0 or x > x_max or y < 2.0 or y > y_max
 
             if close_to_wall:
                 z_estimate = max(0.3, avg_z * 0.7)
@@ -324,91 +386,83 @@ class EnhancedTrilaterationEngine:
                 z_estimate = min(2.5, max(1.0, avg_z))
 
             z_estimate = max(0.3, min(3.0, z_estimate))
-            print(f"   📊 Улучшенная оценка Z: {z_estimate:.2f}m")
+            logger.debug("📊 Улучшенная оценка Z: %.2fm", z_estimate)
             return z_estimate
 
         except Exception as e:
-            print(f"   ⚠️  Ошибка улучшенной оценки Z: {e}")
+            logger.warning("⚠️ Ошибка улучшенной оценки Z: %s", e)
             return 1.5
 
     def _find_circle_intersections(self, center1, radius1, center2, radius2):
         """Находит точки пересечения двух окружностей."""
-        x1, y1 = center1
-        x2, y2 = center2
-        r1, r2 = radius1, radius2
+        # Скалярная арифметика: math быстрее numpy на отдельных числах
+        x1, y1 = float(center1[0]), float(center1[1])
+        x2, y2 = float(center2[0]), float(center2[1])
+        r1, r2 = float(radius1), float(radius2)
 
         # Расстояние между центрами
-        d = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+        dx, dy = x2 - x1, y2 - y1
+        d_squared = dx * dx + dy * dy
+        d = math.sqrt(d_squared)
 
-        # Проверка возможности пересечения
-        if d > r1 + r2 or d < abs(r1 - r2):
+        # Проверка возможности пересечения (совпадающие центры не дают точек)
+        if d < 1e-9 or d > r1 + r2 or d < abs(r1 - r2):
             return None
 
-        # Вычисления точек пересечения
-        a = (r1 ** 2 - r2 ** 2 + d ** 2) / (2 * d)
-        h = np.sqrt(r1 ** 2 - a ** 2)
+        # Единичный вектор между центрами: одно деление вместо шести
+        inv_d = 1.0 / d
+        ex, ey = dx * inv_d, dy * inv_d
 
-        xm = x1 + a * (x2 - x1) / d
-        ym = y1 + a * (y2 - y1) / d
+        # Вычисления точек пересечения
+        a = (r1 * r1 - r2 * r2 + d_squared) * 0.5 * inv_d
+        h = math.sqrt(max(r1 * r1 - a * a, 0.0))
 
-        xs1 = xm + h * (y2 - y1) / d
-        xs2 = xm - h * (y2 - y1) / d
-        ys1 = ym - h * (x2 - x1) / d
-        ys2 = ym + h * (x2 - x1) / d
+        xm = x1 + a * ex
+        ym = y1 + a * ey
 
-        return [(xs1, ys1), (xs2, ys2)]
+        return [(xm + h * ey, ym - h * ex), (xm - h * ey, ym + h * ex)]
 
-    def _select_best_intersection(self, intersections, weighted_measurements):
+    def _select_best_intersection(self, intersections, anchors_xyz, distances, weights):
         """Выбирает лучшую точку пересечения на основе других измерений."""
         if len(intersections) == 1:
             return intersections[0]
 
-        # Оцениваем каждую точку пересечения
-        best_score = float('inf')
-        best_point = intersections[0]
-
-        for point in intersections:
-            score = 0
-            for anchor_id, data in weighted_measurements.items():
-                if anchor_id in self.room_config['anchors']:
-                    anchor = self.room_config['anchors'][anchor_id]
-                    calculated_dist = np.sqrt(
-                        (point[0] - anchor['x']) ** 2 +
-                        (point[1] - anchor['y']) ** 2
-                    )
-                    error = abs(calculated_dist - data['distance'])
-                    score += error * data['weight']
-
-            if score < best_score:
-                best_score = score
-                best_point = point
-
-        return best_point
-
-    def is_valid_position(self, position: Dict[str, float]) -> bool:
+        # Оцениваем каждую точку пересечения: взвешенная ошибка расстояний до всех якорей
+        points = np.asarray(intersections, dtype=np.float64)
+
+        diff = points[:, None, :] - anchors_xyz[None, :, :2]
+        calculated_dist = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+        scores = np.abs(calculated_dist - distances) @ weights
+
+        return intersections[int(np.argmin(scores))]
+
+    def is_valid_position(self, position: Position) -> bool:
         """Проверяет, что позиция находится в пределах комнаты."""
-        x, y, z = position['x'], position['y'], position['z']
-        valid = (0 <= x <= self.room_config['width'] and
-                 0 <= y <= self.room_config['height'] and
+        x, y, z = position
+        width, height = self._room_size
+        valid = (0 <= x <= width and
+                 0 <= y <= height and
                  0 <= z <= 4.0)
 
         if not valid:
-            print(f"⚠️  Позиция вне комнаты: ({x:.2f}, {y:.2f}, {z:.2f})")
+            logger.debug("⚠️ Позиция вне комнаты: (%.2f, %.2f, %.2f)", x, y, z)
 
         return valid
 
-    def correct_position(self, position: Dict[str, float]) -> Dict[str, float]:
+    def correct_position(self, position: Position) -> Position:
         """Корректирует позицию чтобы она была внутри комнаты."""
-        x = max(0.5, min(self.room_config['width'] - 0.5, position['x']))
-        y = max(0.5, min(self.room_config['height'] - 0.5, position['y']))
-        z = max(0.5, min(3.0, position['z']))
-
-        corrected = {'x': x, 'y': y, 'z': z}
-        print(f"   📍 Скорректированная позиция: {corrected}")
+        (x_min, x_max), (y_min, y_max) = self._correction_x, self._correction_y
+        x, y, z = position
+        x = max(x_min, min(x_max, x))
+        y = max(y_min, min(y_max, y))
+        z = max(0.5, min(3.0, z))
+
+        corrected = (x, y, z)
+        logger.debug("📍 Скорректированная позиция: %s", corrected)
         return corrected
 
 
-def calculate_enhanced_confidence(weighted_measurements: Dict[str, Dict[str, Any]],
+def calculate_enhanced_confidence(weighted_measurements: Dict[str, WeightedMeasurement],
                                   position: Dict[str, float],
                                   room_config: Dict[str, Any] = None) -> float:
     """Упрощенный и надежный расчет уверенности."""
@@ -416,36 +470,13 @@ def calculate_enhanced_confidence(weighted_measurements: Dict[str, Dict[str, Any
         if not weighted_measurements:
             return 0.1
 
-        print(f"   🔍 Confidence calculation for {len(weighted_measurements)} anchors")
-
         # 1. Базовая уверенность по количеству якорей
         anchor_count = len(weighted_measurements)
-        if anchor_count >= 4:
-            base_confidence = 0.8
-        elif anchor_count == 3:
-            base_confidence = 0.7
-        elif anchor_count == 2:
-            base_confidence = 0.5
-        else:
-            base_confidence = 0.2
-
-        # 2. Собираем все confidence из weighted_measurements
-        all_confidences = []
-        for anchor_id, data in weighted_measurements.items():
-            # data должен быть словарем с полем 'confidence'
-            if isinstance(data, dict):
-                confidence = data.get('confidence', 0.5)
-                all_confidences.append(confidence)
-                print(f"   📊 Anchor {anchor_id}: confidence={confidence:.2f}")
-            else:
-                print(f"   ⚠️  Invalid data type for anchor {anchor_id}: {type(data)}")
-                all_confidences.append(0.3)  # default
+        base_confidence = BASE_CONFIDENCE_BY_ANCHORS[min(anchor_count, 4)]
 
-        # 3. Средняя уверенность измерений
-        if all_confidences:
-            avg_measurement_confidence = np.mean(all_confidences)
-        else:
-            avg_measurement_confidence = 0.5
+        # 2-3. Средняя уверенность измерений (пустой набор отсечен выше)
+        avg_measurement_confidence = sum(
+            data.confidence for data in weighted_measurements.values()) / anchor_count
 
         # 4. Простая формула: среднее между базовой и средней уверенностью измерений
         total_confidence = (base_confidence + avg_measurement_confidence) / 2
@@ -464,14 +495,11 @@ def calculate_enhanced_confidence(weighted_measurements: Dict[str, Dict[str, Any
         total_confidence *= bonus
         total_confidence = max(0.1, min(1.0, total_confidence))
 
-        print(f"   🎯 Confidence: base={base_confidence:.2f}, "
-              f"measurements={avg_measurement_confidence:.2f}, "
-              f"bonus={bonus:.2f}, total={total_confidence:.2f}")
+        logger.debug("🎯 Confidence: base=%.2f, measurements=%.2f, bonus=%.2f, total=%.2f",
+                     base_confidence, avg_measurement_confidence, bonus, total_confidence)
 
         return total_confidence
 
     except Exception as e:
-        print(f"❌ Ошибка расчета уверенности: {e}")
-        import traceback
-        print(f"   Traceback: {traceback.format_exc()}")
+        logger.exception("❌ Ошибка расчета уверенности: %s", e)
         return 0.5
\ No newline at end of file